@@ -1,31 +1,67 @@
 # app.py - Enhanced Personal Finance Web App
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, g, has_request_context, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import sqlite3
 import json
-from datetime import datetime, date
+from datetime import date
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import threading
 import io
-import matplotlib
-matplotlib.use('Agg')  # Non-GUI backend
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+import orjson
 import pandas as pd
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
+from reportlab.graphics.shapes import Drawing
+from reportlab.graphics.charts.piecharts import Pie
+
+class ORJSONProvider(DefaultJSONProvider):
+    """orjson-backed JSON provider with sorted keys and HTTP dates like Flask's default.
+
+    Not byte-identical: non-ASCII text is emitted as raw UTF-8 instead of \\uXXXX
+    escapes, NaN/Infinity become null, and mixed-type keys are accepted."""
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps_bytes(self, obj, indent=None):
+        option = self.options | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj, indent=kwargs.get('indent')).decode()
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Configuration
 DB_FILE = "finance_web.db"
-CURRENCIES = ["CNY", "USD", "EUR", "GBP", "JPY", "CAD", "AUD"]
-EXPENSE_CATS = ["Food", "Transport", "Rent", "Utilities", "Entertainment", "Groceries", "Health", "Clothing", "Education", "Other"]
-INCOME_CATS = ["Salary", "Bonus", "Part-time", "Interest", "Gift", "Investment", "Freelance", "Other"]
-ALLOWED_TYPES = {"income", "expense", "transfer"}
+CURRENCIES_ORDERED = ("CNY", "USD", "EUR", "GBP", "JPY", "CAD", "AUD")  # display order
+CURRENCIES = frozenset(CURRENCIES_ORDERED)
+EXPENSE_CATS = frozenset({"Food", "Transport", "Rent", "Utilities", "Entertainment", "Groceries", "Health", "Clothing", "Education", "Other"})
+INCOME_CATS = frozenset({"Salary", "Bonus", "Part-time", "Interest", "Gift", "Investment", "Freelance", "Other"})
+ALLOWED_TYPES = frozenset({"income", "expense", "transfer"})
+TRANSACTION_COLUMNS = ("id", "date", "type", "category", "amount", "currency", "account_id", "note", "created_at")
+RECENT_TRANSACTION_COLUMNS = ("id", "date", "type", "category", "amount", "currency", "account_id")
+PIE_COLORS = [colors.HexColor(c) for c in ("#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+                                             "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf")]
+RATES_API_URL = "https://api.exchangerate-api.com/v4/latest/USD"
+
+# Shared HTTP session so rate updates reuse the TCP/TLS connection
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2,
+                                       max_retries=Retry(total=3, backoff_factor=0.3)))
+# Held while a background rate update runs, so only one writer is in flight
+_update_lock = threading.Lock()
 
 # --- Database helpers ---
 def init_db():
     with sqlite3.connect(DB_FILE) as conn:
         c = conn.cursor()
+        # WAL lets dashboard/report readers run while update_rates writes; persisted in the db file
+        c.execute('PRAGMA journal_mode=WAL')
         c.execute('''CREATE TABLE IF NOT EXISTS accounts 
                      (id INTEGER PRIMARY KEY, name TEXT, currency TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
         
@@ -38,9 +74,40 @@ def init_db():
                      (id INTEGER PRIMARY KEY, from_currency TEXT, to_currency TEXT, 
                       rate REAL, date TEXT, source TEXT DEFAULT 'manual')''')
         
+        # Latest rate per pair, kept current by trg_rates_ins
+        c.execute('''CREATE TABLE IF NOT EXISTS latest_rates 
+                     (from_currency TEXT, to_currency TEXT, rate REAL, date TEXT,
+                      PRIMARY KEY (from_currency, to_currency)) WITHOUT ROWID''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS trg_rates_ins AFTER INSERT ON exchange_rates
+                     BEGIN
+                         INSERT INTO latest_rates (from_currency, to_currency, rate, date)
+                         VALUES (NEW.from_currency, NEW.to_currency, NEW.rate, NEW.date)
+                         ON CONFLICT (from_currency, to_currency) DO UPDATE
+                         SET rate = excluded.rate, date = excluded.date
+                         WHERE excluded.date >= latest_rates.date;
+                     END''')
+        
+        # Small key/value store (e.g. HTTP validators of the rates API)
+        c.execute('''CREATE TABLE IF NOT EXISTS kv_cache 
+                     (key TEXT PRIMARY KEY, value TEXT)''')
+        
         # Indexes
         c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date)')
         c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(type)')
+        # covers the dashboard's per-account GROUP BY (index-only) as well as account+date seeks
+        acct_cols = [r[2] for r in c.execute('PRAGMA index_info(idx_tx_acct_date)')]
+        if acct_cols and acct_cols != ['account_id', 'date', 'type', 'currency', 'amount']:
+            c.execute('DROP INDEX idx_tx_acct_date')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_tx_acct_date ON transactions(account_id, date, type, currency, amount)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_tx_date_type ON transactions(date, type, category, amount)')
+        # one rate per pair and day (newer writes replace). One-time migration: older databases may
+        # have a non-unique idx_rates_pair_date and same-day duplicates, which block the unique index.
+        rate_indexes = {r[1]: r[2] for r in c.execute('PRAGMA index_list(exchange_rates)')}
+        if not rate_indexes.get('idx_rates_pair_date'):
+            c.execute('DROP INDEX IF EXISTS idx_rates_pair_date')
+            c.execute('''DELETE FROM exchange_rates WHERE id NOT IN
+                         (SELECT MAX(id) FROM exchange_rates GROUP BY from_currency, to_currency, date)''')
+            c.execute('CREATE UNIQUE INDEX idx_rates_pair_date ON exchange_rates(from_currency, to_currency, date DESC)')
         
         # Default account
         c.execute("SELECT COUNT(*) FROM accounts")
@@ -58,75 +125,169 @@ def init_db():
             for from_curr, to_curr, rate in default_rates:
                 c.execute("INSERT INTO exchange_rates (from_currency, to_currency, rate, date, source) VALUES (?, ?, ?, ?, ?)",
                          (from_curr, to_curr, rate, today, "default"))
+        # rebuild latest_rates from history (covers databases created before the trigger existed)
+        c.execute('DELETE FROM latest_rates')
+        c.execute('''INSERT INTO latest_rates (from_currency, to_currency, rate, date)
+                     SELECT from_currency, to_currency, rate, date FROM exchange_rates r
+                     WHERE id = (SELECT id FROM exchange_rates
+                                 WHERE from_currency = r.from_currency AND to_currency = r.to_currency
+                                 ORDER BY date DESC, id DESC LIMIT 1)''')
+        # refresh planner statistics so the composite indexes above get picked
+        c.execute('ANALYZE')
         conn.commit()
 
 def get_db_conn():
     conn = sqlite3.connect(DB_FILE, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
     conn.row_factory = sqlite3.Row
+    # per-connection settings (only journal_mode is persisted by init_db)
+    conn.executescript('''PRAGMA foreign_keys=ON;
+                          PRAGMA busy_timeout=5000;
+                          PRAGMA synchronous=NORMAL;
+                          PRAGMA mmap_size=268435456;
+                          PRAGMA cache_size=-65536;
+                          PRAGMA temp_store=MEMORY;''')
     return conn
 
+def request_conn(conn=None):
+    """Return conn if given, else the request-scoped connection, else a fresh one (outside requests)."""
+    if conn is not None:
+        return conn
+    if not has_request_context():
+        return get_db_conn()
+    if 'db' not in g:
+        g.db = get_db_conn()
+    return g.db
+
+@app.teardown_request
+def close_request_conn(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
 # --- Utility functions ---
 def parse_iso_date(datestr):
     """Expect YYYY-MM-DD; raise ValueError if invalid."""
     try:
-        return datetime.strptime(datestr, "%Y-%m-%d").date()
-    except Exception as e:
+        # fromisoformat also takes YYYYMMDD / week dates on 3.11+, so check the shape first
+        if len(datestr) != 10 or datestr[4] != '-' or datestr[7] != '-':
+            raise ValueError()
+        return date.fromisoformat(datestr)
+    except (TypeError, ValueError):
         raise ValueError("Date must be in YYYY-MM-DD format")
 
-def get_accounts():
-    with get_db_conn() as conn:
+def _norm_currency(value, default=''):
+    """Normalize a currency code from request data ('' when missing and no default)."""
+    return (value or default).strip().upper()
+
+def month_bounds(year, month):
+    """Return (start, end) ISO dates covering [first day of month, first day of next month)."""
+    year, month = int(year), int(month)
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year:04d}-{month:02d}-01", f"{next_year:04d}-{next_month:02d}-01"
+
+def get_accounts(conn=None):
+    with request_conn(conn) as conn:
         rows = conn.execute('SELECT * FROM accounts ORDER BY name').fetchall()
         return [dict(r) for r in rows]
 
-def get_transactions(limit=100, account_id=None, year=None, month=None):
-    with get_db_conn() as conn:
-        query = '''SELECT t.*, a.name as account_name 
-                   FROM transactions t 
-                   LEFT JOIN accounts a ON t.account_id = a.id'''
-        params = []
-        conditions = []
-        if account_id:
-            conditions.append('t.account_id = ?')
-            params.append(account_id)
-        if year and month:
-            # Ensure month two-digit
-            conditions.append("strftime('%Y', t.date) = ? AND strftime('%m', t.date) = ?")
-            params.extend([str(year), f"{int(month):02d}"])
-        if conditions:
-            query += ' WHERE ' + ' AND '.join(conditions)
-        query += ' ORDER BY t.date DESC, t.id DESC LIMIT ?'
-        params.append(limit)
+def _transactions_sql(year=None, month=None, account_id=None, limit=100, columns=None):
+    """Build the transaction listing query; returns (sql, params).
+
+    columns is a subset of TRANSACTION_COLUMNS (default: all); account_name is always included."""
+    columns = columns or TRANSACTION_COLUMNS
+    unknown = set(columns) - set(TRANSACTION_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown transaction columns: {sorted(unknown)}")
+    select_list = ', '.join(f't.{col}' for col in columns)
+    query = f'''SELECT {select_list}, a.name as account_name 
+               FROM transactions t 
+               LEFT JOIN accounts a ON t.account_id = a.id'''
+    params = []
+    conditions = []
+    if account_id:
+        conditions.append('t.account_id = ?')
+        params.append(account_id)
+    if year and month:
+        # Range predicate on the raw column so idx_transactions_date can be used
+        conditions.append('t.date >= ? AND t.date < ?')
+        params.extend(month_bounds(year, month))
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY t.date DESC, t.id DESC LIMIT ?'
+    params.append(limit)
+    return query, params
+
+def get_transactions(limit=100, account_id=None, year=None, month=None, columns=None, conn=None):
+    query, params = _transactions_sql(year=year, month=month, account_id=account_id, limit=limit, columns=columns)
+    with request_conn(conn) as conn:
         rows = conn.execute(query, params).fetchall()
         return [dict(r) for r in rows]
 
-def get_exchange_rates(limit=50):
-    with get_db_conn() as conn:
+def get_exchange_rates(limit=50, conn=None):
+    with request_conn(conn) as conn:
         rows = conn.execute('''SELECT * FROM exchange_rates 
                                ORDER BY date DESC LIMIT ?''', (limit,)).fetchall()
         return [dict(r) for r in rows]
 
-def get_latest_rate(from_currency, to_currency):
-    """Return latest rate from->to. If missing try reverse, then via USD if possible, else 1.0"""
+def get_monthly_summary(year, month, conn=None):
+    """Income/expense totals and per-category sums for one month, aggregated in SQL."""
+    month_start, month_end = month_bounds(year, month)
+    with request_conn(conn) as conn:
+        totals = conn.execute('''
+            SELECT COALESCE(SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END), 0) as income_total,
+                   COALESCE(SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END), 0) as expense_total,
+                   COUNT(*) as transaction_count
+            FROM transactions
+            WHERE date >= ? AND date < ?
+        ''', (month_start, month_end)).fetchone()
+        by_category = conn.execute('''
+            SELECT type, category, SUM(amount) as total
+            FROM transactions
+            WHERE date >= ? AND date < ?
+            GROUP BY type, category
+        ''', (month_start, month_end)).fetchall()
+    expense_by_category = {}
+    income_by_category = {}
+    for r in by_category:
+        if r['type'] == 'expense':
+            expense_by_category[r['category']] = r['total']
+        else:
+            income_by_category[r['category']] = income_by_category.get(r['category'], 0) + r['total']
+    income_total = totals['income_total']
+    expense_total = totals['expense_total']
+    return {
+        'year': year,
+        'month': month,
+        'income_total': income_total,
+        'expense_total': expense_total,
+        'net': income_total - expense_total,
+        'transaction_count': totals['transaction_count'],
+        'expense_by_category': expense_by_category,
+        'income_by_category': income_by_category
+    }
+
+def load_latest_rates(conn):
+    """Return {(from_currency, to_currency): rate} holding the latest rate of every pair."""
+    rows = conn.execute('SELECT from_currency, to_currency, rate FROM latest_rates').fetchall()
+    return {(r['from_currency'], r['to_currency']): r['rate'] for r in rows}
+
+def lookup_rate(rates, from_currency, to_currency):
+    """Latest rate from->to in a load_latest_rates() dict. If missing try reverse, then via USD, else 1.0"""
     if from_currency == to_currency:
         return 1.0
-    with get_db_conn() as conn:
-        r = conn.execute('''SELECT rate FROM exchange_rates 
-                            WHERE from_currency = ? AND to_currency = ? 
-                            ORDER BY date DESC LIMIT 1''', (from_currency, to_currency)).fetchone()
-        if r:
-            return r['rate']
-        # Try reverse
-        r2 = conn.execute('''SELECT rate FROM exchange_rates 
-                             WHERE from_currency = ? AND to_currency = ? 
-                             ORDER BY date DESC LIMIT 1''', (to_currency, from_currency)).fetchone()
-        if r2 and r2['rate'] != 0:
-            return 1.0 / r2['rate']
-        # Try via USD if available
-        if from_currency != 'USD' and to_currency != 'USD':
-            r_from_usd = conn.execute('''SELECT rate FROM exchange_rates WHERE from_currency = ? AND to_currency = ? ORDER BY date DESC LIMIT 1''', (from_currency, 'USD')).fetchone()
-            r_usd_to = conn.execute('''SELECT rate FROM exchange_rates WHERE from_currency = ? AND to_currency = ? ORDER BY date DESC LIMIT 1''', ('USD', to_currency)).fetchone()
-            if r_from_usd and r_usd_to and r_from_usd['rate'] and r_usd_to['rate']:
-                return r_from_usd['rate'] * r_usd_to['rate']
+    rate = rates.get((from_currency, to_currency))
+    if rate:
+        return rate
+    # Try reverse
+    reverse = rates.get((to_currency, from_currency))
+    if reverse:
+        return 1.0 / reverse
+    # Try via USD if available
+    if from_currency != 'USD' and to_currency != 'USD':
+        from_usd = rates.get((from_currency, 'USD'))
+        usd_to = rates.get(('USD', to_currency))
+        if from_usd and usd_to:
+            return from_usd * usd_to
     return 1.0
 
 # --- API Routes ---
@@ -142,12 +303,12 @@ def api_get_accounts():
 def api_add_account():
     data = request.json or {}
     name = (data.get('name') or '').strip()
-    currency = (data.get('currency') or 'CNY').upper()
+    currency = _norm_currency(data.get('currency'), 'CNY')
     if not name:
         return jsonify({'error': 'Account name is required'}), 400
     if currency not in CURRENCIES:
         return jsonify({'error': f'Unsupported currency: {currency}'}), 400
-    with get_db_conn() as conn:
+    with request_conn() as conn:
         cur = conn.execute('INSERT INTO accounts (name, currency) VALUES (?, ?)', (name, currency))
         account_id = cur.lastrowid
         conn.commit()
@@ -191,19 +352,19 @@ def api_add_transaction():
             raise ValueError()
     except:
         return jsonify({'error': 'Invalid amount; must be positive number'}), 400
-    currency = (data['currency'] or 'CNY').upper()
+    currency = _norm_currency(data['currency'], 'CNY')
     if currency not in CURRENCIES:
         return jsonify({'error': f'Unsupported currency: {currency}'}), 400
     account_id = data.get('account_id')
     if not account_id:
-        with get_db_conn() as conn:
+        with request_conn() as conn:
             first_account = conn.execute('SELECT id FROM accounts LIMIT 1').fetchone()
             if first_account:
                 account_id = first_account['id']
             else:
                 return jsonify({'error': 'No accounts found'}), 400
     note = data.get('note', '')
-    with get_db_conn() as conn:
+    with request_conn() as conn:
         cur = conn.execute('''INSERT INTO transactions 
                         (date, type, category, amount, currency, account_id, note)
                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
@@ -215,7 +376,7 @@ def api_add_transaction():
 @app.route('/api/transactions/<int:tx_id>', methods=['PUT'])
 def api_update_transaction(tx_id):
     data = request.json or {}
-    with get_db_conn() as conn:
+    with request_conn() as conn:
         exists = conn.execute('SELECT 1 FROM transactions WHERE id = ?', (tx_id,)).fetchone()
         if not exists:
             return jsonify({'error': 'transaction not found'}), 404
@@ -242,7 +403,7 @@ def api_update_transaction(tx_id):
                 return jsonify({'error': 'Invalid amount'}), 400
             fields.append('amount = ?'); params.append(amt)
         if 'currency' in data:
-            cur = data['currency'].upper()
+            cur = _norm_currency(data['currency'])
             if cur not in CURRENCIES:
                 return jsonify({'error': f'Unsupported currency: {cur}'}), 400
             fields.append('currency = ?'); params.append(cur)
@@ -260,7 +421,7 @@ def api_update_transaction(tx_id):
 
 @app.route('/api/transactions/<int:tx_id>', methods=['DELETE'])
 def api_delete_transaction(tx_id):
-    with get_db_conn() as conn:
+    with request_conn() as conn:
         cur = conn.execute('DELETE FROM transactions WHERE id = ?', (tx_id,))
         conn.commit()
         if cur.rowcount == 0:
@@ -274,8 +435,8 @@ def api_get_rates():
 @app.route('/api/exchange-rates', methods=['POST'])
 def api_add_rate():
     data = request.json or {}
-    from_currency = (data.get('from_currency') or '').upper()
-    to_currency = (data.get('to_currency') or '').upper()
+    from_currency = _norm_currency(data.get('from_currency'))
+    to_currency = _norm_currency(data.get('to_currency'))
     rate = data.get('rate')
     if not from_currency or not to_currency or rate is None:
         return jsonify({'error': 'All fields are required (from_currency, to_currency, rate)'}), 400
@@ -287,8 +448,8 @@ def api_add_rate():
         return jsonify({'error': 'Invalid rate; must be positive number'}), 400
     if from_currency not in CURRENCIES or to_currency not in CURRENCIES:
         return jsonify({'error': 'Unsupported currency in from/to'}), 400
-    with get_db_conn() as conn:
-        conn.execute('''INSERT INTO exchange_rates (from_currency, to_currency, rate, date, source)
+    with request_conn() as conn:
+        conn.execute('''INSERT OR REPLACE INTO exchange_rates (from_currency, to_currency, rate, date, source)
                         VALUES (?, ?, ?, ?, ?)''',
                      (from_currency, to_currency, rate, date.today().isoformat(), 'manual'))
         conn.commit()
@@ -296,162 +457,178 @@ def api_add_rate():
 
 @app.route('/api/exchange-rates/update', methods=['POST'])
 def api_update_rates():
+    if not _update_lock.acquire(blocking=False):
+        return jsonify({'message': 'Exchange rates update already running'}), 429
     def update_rates():
         try:
-            response = requests.get('https://api.exchangerate-api.com/v4/latest/USD', timeout=12)
-            response.raise_for_status()
-            data = response.json()
-            rates = data.get('rates', {})
-            today = date.today().isoformat()
-            inserted = 0
-            with get_db_conn() as conn:
-                for currency in CURRENCIES:
-                    if currency in rates and currency != 'USD':
-                        conn.execute('''INSERT INTO exchange_rates 
-                                       (from_currency, to_currency, rate, date, source)
-                                       VALUES (?, ?, ?, ?, ?)''',
-                                     ('USD', currency, float(rates[currency]), today, 'api'))
-                        inserted += 1
-                conn.commit()
-            app.logger.info(f"update_rates: inserted {inserted} rates")
+            conn = get_db_conn()  # background thread: no request context
+            try:
+                # conditional GET: send the validators of the last accepted response
+                cached = dict(conn.execute("SELECT key, value FROM kv_cache WHERE key IN ('rates_etag', 'rates_last_modified')").fetchall())
+                headers = {}
+                if cached.get('rates_etag'):
+                    headers['If-None-Match'] = cached['rates_etag']
+                if cached.get('rates_last_modified'):
+                    headers['If-Modified-Since'] = cached['rates_last_modified']
+                response = _SESSION.get(RATES_API_URL, headers=headers, timeout=12)
+                if response.status_code == 304:
+                    app.logger.info("update_rates: rates not modified")
+                    return True
+                response.raise_for_status()
+                data = response.json()
+                rates = data.get('rates', {})
+                today = date.today().isoformat()
+                params = [('USD', currency, float(rates[currency]), today, 'api')
+                          for currency in CURRENCIES_ORDERED if currency in rates and currency != 'USD']
+                validators = [(key, response.headers[header])
+                              for key, header in (('rates_etag', 'ETag'), ('rates_last_modified', 'Last-Modified'))
+                              if response.headers.get(header)]
+                with conn:
+                    conn.executemany('''INSERT OR REPLACE INTO exchange_rates
+                                         (from_currency, to_currency, rate, date, source)
+                                         VALUES (?, ?, ?, ?, ?)''', params)
+                    conn.executemany('INSERT OR REPLACE INTO kv_cache (key, value) VALUES (?, ?)', validators)
+            finally:
+                conn.close()
+            app.logger.info(f"update_rates: inserted {len(params)} rates")
             return True
         except Exception as e:
             app.logger.exception("update_rates failed")
             return False
+        finally:
+            _update_lock.release()
     thread = threading.Thread(target=update_rates, daemon=True)
-    thread.start()
+    try:
+        thread.start()
+    except Exception:
+        # update_rates never ran, so its finally won't release the lock
+        _update_lock.release()
+        raise
     return jsonify({'message': 'Exchange rates update started (background)'}), 202
 
 @app.route('/api/dashboard')
 def api_dashboard():
     """Get dashboard summary data including per-account balances (converted to account currency)."""
-    with get_db_conn() as conn:
+    with request_conn() as conn:
         # current month summary grouped by type and currency
         current_date = date.today()
-        yr = current_date.year
-        mo = current_date.month
+        month_start, month_end = month_bounds(current_date.year, current_date.month)
         monthly_transactions = conn.execute('''
             SELECT type, SUM(amount) as total, currency
             FROM transactions 
-            WHERE strftime('%Y', date) = ? AND strftime('%m', date) = ?
+            WHERE date >= ? AND date < ?
             GROUP BY type, currency
-        ''', (str(yr), f"{mo:02d}")).fetchall()
-        recent = conn.execute('''
-            SELECT t.*, a.name as account_name 
-            FROM transactions t 
-            LEFT JOIN accounts a ON t.account_id = a.id 
-            ORDER BY t.date DESC, t.id DESC 
-            LIMIT 10
-        ''').fetchall()
+        ''', (month_start, month_end)).fetchall()
+        recent = get_transactions(limit=10, columns=RECENT_TRANSACTION_COLUMNS, conn=conn)
         accounts = conn.execute('SELECT * FROM accounts').fetchall()
-        # compute simplified balances per account (sum income - expense; assume all amounts positive and type indicates sign)
+        # one grouped scan for all accounts plus one query for the latest rates; conversion is done in memory
+        totals = conn.execute('''
+            SELECT account_id, type, currency, SUM(amount) as total
+            FROM transactions
+            GROUP BY account_id, type, currency
+        ''').fetchall()
+        rates = load_latest_rates(conn)
+        acc_currency_by_id = {acc['id']: acc['currency'] for acc in accounts}
+        balances = {}
+        for r in totals:
+            acc_id = r['account_id']
+            if acc_id not in acc_currency_by_id:
+                continue
+            # convert total from its currency to the account currency using latest rate
+            converted = float(r['total']) * lookup_rate(rates, r['currency'], acc_currency_by_id[acc_id])
+            if r['type'] == 'expense':
+                converted = -converted
+            balances[acc_id] = balances.get(acc_id, 0.0) + converted
         account_balances = []
         for acc in accounts:
             acc = dict(acc)
-            acc_id = acc['id']
-            acc_currency = acc['currency']
-            rows = conn.execute('SELECT type, amount, currency FROM transactions WHERE account_id = ?', (acc_id,)).fetchall()
-            balance = 0.0
-            for r in rows:
-                amt = float(r['amount'])
-                src_curr = r['currency']
-                # convert amount from src_curr to acc_currency using latest rate
-                rate = get_latest_rate(src_curr, acc_currency)
-                converted = amt * rate
-                if r['type'] == 'expense':
-                    balance -= converted
-                else:
-                    balance += converted
-            acc['balance'] = round(balance, 2)
+            acc['balance'] = round(balances.get(acc['id'], 0.0), 2)
             account_balances.append(acc)
     return jsonify({
         'monthly_summary': [dict(r) for r in monthly_transactions],
-        'recent_transactions': [dict(r) for r in recent],
+        'recent_transactions': recent,
         'accounts': account_balances
     })
 
 @app.route('/api/reports/monthly/<int:year>/<int:month>')
 def api_monthly_report(year, month):
-    """Return monthly report data in JSON (same logic as earlier)."""
-    transactions = get_transactions(limit=10000, account_id=None, year=year, month=month)
-    income_total = sum(tx['amount'] for tx in transactions if tx['type'] == 'income')
-    expense_total = sum(tx['amount'] for tx in transactions if tx['type'] == 'expense')
-    expense_by_category = {}
-    income_by_category = {}
-    for tx in transactions:
-        category = tx['category']
-        amount = tx['amount']
-        if tx['type'] == 'expense':
-            expense_by_category[category] = expense_by_category.get(category, 0) + amount
-        else:
-            income_by_category[category] = income_by_category.get(category, 0) + amount
-    return jsonify({
-        'year': year,
-        'month': month,
-        'income_total': income_total,
-        'expense_total': expense_total,
-        'net': income_total - expense_total,
-        'transaction_count': len(transactions),
-        'expense_by_category': expense_by_category,
-        'income_by_category': income_by_category,
-        'transactions': transactions
-    })
+    """Return monthly report data in JSON; pass ?include_transactions=1 to also get the row list."""
+    report = get_monthly_summary(year, month)
+    if request.args.get('include_transactions', 0, type=int):
+        report['transactions'] = get_transactions(limit=10000, account_id=None, year=year, month=month)
+    return jsonify(report)
+
+@app.route('/api/reports/monthly/<int:year>/<int:month>.ndjson')
+def api_monthly_report_ndjson(year, month):
+    """Stream the monthly report as NDJSON: the summary line, then one line per transaction."""
+    conn = request_conn()
+    summary = get_monthly_summary(year, month, conn=conn)
+    # no row cap: rows are encoded one at a time straight off the cursor
+    sql, params = _transactions_sql(year=year, month=month, limit=-1)
+    def generate():
+        yield app.json.dumps_bytes(summary) + b"\n"
+        for row in conn.execute(sql, params):
+            yield app.json.dumps_bytes(dict(row)) + b"\n"
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/api/reports/monthly/<int:year>/<int:month>/pdf')
 def api_monthly_report_pdf(year, month):
     """Generate PDF monthly report and return as downloadable file."""
-    transactions = get_transactions(limit=10000, account_id=None, year=year, month=month)
-    # build DataFrame for nice table
-    if transactions:
-        df = pd.DataFrame(transactions)
-    else:
-        df = pd.DataFrame(columns=['id','date','type','category','amount','currency','account_id','note','created_at','account_name'])
-    income_total = df[df['type']=='income']['amount'].sum() if not df.empty else 0.0
-    expense_total = df[df['type']=='expense']['amount'].sum() if not df.empty else 0.0
+    # read straight into typed columns instead of going through a list of dicts
+    sql, params = _transactions_sql(year=year, month=month, limit=10000)
+    df = pd.read_sql_query(sql, request_conn(), params=params, parse_dates=['date', 'created_at'])
+    styles = getSampleStyleSheet()
+    story = [Paragraph(f"Monthly Report: {year}-{month:02d}", styles['Title'])]
+    if df.empty:
+        # fast path: nothing to aggregate, chart or tabulate
+        story.append(Paragraph("No transactions recorded for this month.", styles['Normal']))
+        return send_pdf_report(story, year, month)
+    # one grouped pass each for totals and categories (also fine on an empty frame)
+    totals = df.groupby('type')['amount'].sum()
+    income_total = float(totals.get('income', 0.0))
+    expense_total = float(totals.get('expense', 0.0))
     # category pie for expenses
-    expense_by_category = df[df['type']=='expense'].groupby('category')['amount'].sum() if not df.empty else pd.Series(dtype=float)
-    # create PDF in memory
+    by_category = df.groupby(['type', 'category'])['amount'].sum()
+    expense_by_category = by_category.xs('expense') if 'expense' in totals.index else pd.Series(dtype=float)
+    # Page 1: summary text
+    info_lines = [
+        f"Income total: {income_total:.2f}",
+        f"Expense total: {expense_total:.2f}",
+        f"Net: {(income_total - expense_total):.2f}",
+        f"Transactions: {len(df)}"
+    ]
+    for line in info_lines:
+        story.append(Paragraph(line, styles['Normal']))
+    # expense by category pie (if available)
+    if not expense_by_category.empty:
+        expense_total_pie = float(expense_by_category.sum())
+        drawing = Drawing(500, 300)
+        pie = Pie()
+        pie.x, pie.y, pie.width, pie.height = 150, 30, 240, 240
+        pie.data = [float(v) for v in expense_by_category.values]
+        pie.labels = [f"{cat} ({float(v) / expense_total_pie:.1%})" for cat, v in expense_by_category.items()]
+        for i in range(len(pie.data)):
+            pie.slices[i].fillColor = PIE_COLORS[i % len(PIE_COLORS)]
+        drawing.add(pie)
+        story += [Spacer(1, 24), Paragraph('Expense by Category', styles['Heading2']), drawing]
+    # transaction table, header row repeated on every page
+    rows = [list(df.columns)] + df.fillna('').astype(str).values.tolist()
+    tbl = Table(rows, repeatRows=1)
+    tbl.setStyle(TableStyle([
+        ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    story += [PageBreak(), Paragraph('Transactions', styles['Heading2']), tbl]
+    return send_pdf_report(story, year, month)
+
+def send_pdf_report(story, year, month):
+    """Render a ReportLab story in memory and return it as a downloadable monthly report."""
     buf = io.BytesIO()
-    with PdfPages(buf) as pdf:
-        # Page 1: summary text
-        plt.figure(figsize=(8.27, 11.69))  # A4 portrait
-        plt.axis('off')
-        plt.title(f"Monthly Report: {year}-{month:02d}", fontsize=16)
-        info_lines = [
-            f"Income total: {income_total:.2f}",
-            f"Expense total: {expense_total:.2f}",
-            f"Net: {(income_total - expense_total):.2f}",
-            f"Transactions: {len(df)}"
-        ]
-        for i, line in enumerate(info_lines):
-            plt.text(0.1, 0.85 - i*0.06, line, fontsize=12, transform=plt.gcf().transFigure)
-        pdf.savefig()
-        plt.close()
-        # Page 2: expense by category pie (if available)
-        if not expense_by_category.empty:
-            plt.figure(figsize=(8,6))
-            expense_by_category.plot.pie(autopct='%1.1f%%', ylabel='', title='Expense by Category')
-            pdf.savefig()
-            plt.close()
-        # Page 3+: transaction table(s) split if large
-        if not df.empty:
-            # render table as text in matplotlib (simple)
-            rows_per_page = 25
-            total_rows = len(df)
-            pages = (total_rows + rows_per_page - 1) // rows_per_page
-            for p in range(pages):
-                start = p * rows_per_page
-                end = min(start + rows_per_page, total_rows)
-                sub = df.iloc[start:end]
-                plt.figure(figsize=(11.69, 8.27))  # landscape for table
-                plt.axis('off')
-                tbl = plt.table(cellText=sub.values, colLabels=sub.columns, loc='center', cellLoc='left')
-                tbl.auto_set_font_size(False)
-                tbl.set_fontsize(8)
-                tbl.scale(1, 1.2)
-                plt.title(f"Transactions {start+1} - {end}")
-                pdf.savefig()
-                plt.close()
+    # landscape so the full-width transaction table fits
+    SimpleDocTemplate(buf, pagesize=landscape(A4), title=f"Monthly Report {year}-{month:02d}").build(story)
     buf.seek(0)
     filename = f"monthly_report_{year}_{month:02d}.pdf"
     return send_file(buf, as_attachment=True, download_name=filename, mimetype='application/pdf')
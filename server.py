@@ -3,13 +3,124 @@ import json
 import sqlite3
 import requests
 from datetime import datetime, date
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import urllib.parse as urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import os
+import queue
+import math
+import gzip
+import logging
+import re
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib encoder
+    orjson = None
+
+DB_FILE = 'finance.db'
+
+# Explicit select lists: only the columns the API returns (created_at is used for ordering only)
+TRANSACTION_COLUMNS = "id, date, type, category, amount, currency, COALESCE(note, '') AS note"
+RATE_COLUMNS = "id, from_currency, to_currency, rate, date, source"
+
+logger = logging.getLogger('finance')
+logger.setLevel(logging.INFO)
+
+_json_encoder = json.JSONEncoder(default=str)
+GZIP_MIN_SIZE = 1024  # smaller bodies aren't worth the CPU
+MAX_BODY_SIZE = 1024 * 1024
+
+# Response cache for read endpoints: key -> (expires_at, payload bytes).
+# A key's generation is bumped on invalidation so a read that raced a write is not stored.
+RATES_CACHE_TTL = 3600
+DASHBOARD_CACHE_TTL = 10
+_cache = {}
+_cache_generation = {}
+_cache_lock = threading.Lock()
+
+def cache_lookup(key):
+    """Return (payload, generation); payload is None on a miss or an expired entry."""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1], None
+        return None, _cache_generation.get(key, 0)
+
+def cache_store(key, generation, payload, ttl):
+    with _cache_lock:
+        if _cache_generation.get(key, 0) == generation:
+            _cache[key] = (time.monotonic() + ttl, payload)
+
+def cache_invalidate(*keys):
+    with _cache_lock:
+        for key in keys:
+            _cache.pop(key, None)
+            _cache_generation[key] = _cache_generation.get(key, 0) + 1
+
+def encode_json(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=str).encode()
+
+# Idle connections shared by all handler threads (ThreadingHTTPServer starts a thread per request)
+_pool = queue.SimpleQueue()
 
 # Database setup
+def open_connection():
+    # pooled connections live for the whole process, so their prepared-statement cache keeps paying off
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    conn.executescript('''
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+    ''')
+    return conn
+
+@contextmanager
+def get_conn():
+    """Borrow a pooled connection, opening one if none is idle; returned to the pool afterwards."""
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = open_connection()
+    try:
+        yield conn
+    finally:
+        # never hand a half-finished transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put(conn)
+
+def month_range(year, month):
+    """Return (start, end) ISO dates so that start <= date < end covers the month."""
+    return f"{year}-{month:02d}-01", f"{year + month // 12}-{month % 12 + 1:02d}-01"
+
+def parse_transaction(data):
+    """Validate a POSTed transaction; returns the INSERT parameters, or None if it is malformed."""
+    if not isinstance(data, dict):
+        return None
+    for field in ('date', 'type', 'category', 'currency'):
+        if not isinstance(data.get(field), str) or not data[field]:
+            return None
+    amount = data.get('amount')
+    if isinstance(amount, bool):
+        return None
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        return None
+    note = data.get('note') or ''
+    if not math.isfinite(amount) or not isinstance(note, str):
+        return None
+    return data['date'], data['type'], data['category'], amount, data['currency'], note
+
 def init_database():
-    conn = sqlite3.connect('finance.db')
+    conn = open_connection()
     cursor = conn.cursor()
     
     # Create transactions table
@@ -39,44 +150,71 @@ def init_database():
         )
     ''')
     
+    # Indexes: list ordering, and month-range aggregation answered from the index alone
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_date ON transactions(date DESC, created_at DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_date_type_cat ON transactions(date, type, category, amount)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rates_created ON exchange_rates(created_at DESC)')
+    
     conn.commit()
     conn.close()
 
+def load_static(filename, content_type):
+    """Read a static file once; returns (content_type, body, etag) or None if it is missing."""
+    try:
+        with open(filename, 'rb') as f:
+            body = f.read()
+    except FileNotFoundError:
+        return None
+    return content_type, body, '"%s"' % hashlib.md5(body).hexdigest()
+
+# The SPA doesn't change while the server runs, so serve it from memory
+INDEX_HTML = load_static('index.html', 'text/html')
+
+_MONTHLY_RE = re.compile(r'^/api/reports/monthly/(\d{4})/(\d{1,2})/?$')
+
+def route_path(raw_path):
+    """Request path without the query string (cheaper than a full urlparse)."""
+    q = raw_path.find('?')
+    return raw_path if q < 0 else raw_path[:q]
+
 class FinanceHandler(BaseHTTPRequestHandler):
+    # Buffer wfile so status line, headers and a small body leave in one send();
+    # handle_one_request() flushes it after every request.
+    wbufsize = 64 * 1024
+    
     def do_GET(self):
-        parsed_path = urlparse.urlparse(self.path)
-        path = parsed_path.path
-        
-        # Serve static files
-        if path == '/' or path == '/index.html':
-            self.serve_file('index.html', 'text/html')
-        elif path == '/api/transactions':
-            self.handle_get_transactions()
-        elif path == '/api/exchange-rates':
-            self.handle_get_rates()
-        elif path == '/api/dashboard':
-            self.handle_get_dashboard()
+        path = route_path(self.path)
+        handler = self._GET_ROUTES.get(path)
+        if handler:
+            handler(self)
         elif path.startswith('/api/reports/monthly/'):
             self.handle_get_monthly_report()
         else:
             self.send_error(404, f"Not Found: {self.path}")
     
     def do_POST(self):
-        content_length = int(self.headers.get('Content-Length', 0))
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            if content_length < 0:
+                raise ValueError(content_length)
+        except ValueError:
+            self.send_error(400, "Invalid Content-Length")
+            return
+        if content_length > MAX_BODY_SIZE:
+            self.send_error(413, "Request body too large")
+            return
         post_data = self.rfile.read(content_length)
         
+        # json.loads decodes UTF-8 bytes itself; ValueError covers JSON and
+        # UTF-8 decode errors, RecursionError deeply nested bodies
         try:
-            data = json.loads(post_data.decode('utf-8'))
-        except:
+            data = json.loads(post_data) if post_data else {}
+        except (ValueError, RecursionError):
             data = {}
         
-        parsed_path = urlparse.urlparse(self.path)
-        path = parsed_path.path
-        
-        if path == '/api/transactions':
-            self.handle_add_transaction(data)
-        elif path == '/api/exchange-rates/update':
-            self.handle_update_rates()
+        handler = self._POST_ROUTES.get(route_path(self.path))
+        if handler:
+            handler(self, data)
         else:
             self.send_error(404, f"Not Found: {self.path}")
     
@@ -87,6 +225,26 @@ class FinanceHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
     
+    def serve_index(self):
+        if INDEX_HTML:
+            self.serve_cached(*INDEX_HTML)
+        else:
+            self.serve_file('index.html', 'text/html')
+    
+    def serve_cached(self, content_type, body, etag):
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+    
     def serve_file(self, filename, content_type):
         try:
             with open(filename, 'rb') as f:
@@ -99,88 +257,101 @@ class FinanceHandler(BaseHTTPRequestHandler):
         except FileNotFoundError:
             self.send_error(404, f"File not found: {filename}")
     
+    def accepts_gzip(self):
+        return 'gzip' in self.headers.get('Accept-Encoding', '')
+    
+    def send_json_bytes(self, payload, status_code=200):
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Vary', 'Accept-Encoding')
+        if len(payload) > GZIP_MIN_SIZE and self.accepts_gzip():
+            payload = gzip.compress(payload, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
     def send_json_response(self, data, status_code=200):
+        # compression needs the whole body, so gzip clients skip the streaming path
+        if orjson is not None or self.accepts_gzip():
+            self.send_json_bytes(encode_json(data), status_code)
+            return
         self.send_response(status_code)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(json.dumps(data, default=str).encode())
+        # Encode incrementally (no Content-Length: HTTP/1.0 closes the connection after the body);
+        # the buffered wfile coalesces the fragments into large send() calls.
+        for chunk in _json_encoder.iterencode(data):
+            self.wfile.write(chunk.encode('utf-8'))
     
     def handle_get_transactions(self):
         try:
-            conn = sqlite3.connect('finance.db')
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM transactions ORDER BY date DESC, created_at DESC')
-            rows = cursor.fetchall()
-            conn.close()
+            with get_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT {TRANSACTION_COLUMNS}
+                    FROM transactions ORDER BY date DESC, created_at DESC
+                ''')
+                transactions = [dict(row) for row in cursor.fetchall()]
             
-            transactions = []
-            for row in rows:
-                transactions.append({
-                    'id': row[0],
-                    'date': row[1],
-                    'type': row[2],
-                    'category': row[3],
-                    'amount': row[4],
-                    'currency': row[5],
-                    'note': row[6] or ''
-                })
-            
-            print(f"Returning {len(transactions)} transactions")
+            logger.debug("Returning %d transactions", len(transactions))
             self.send_json_response(transactions)
         except Exception as e:
-            print(f"Error getting transactions: {e}")
+            logger.exception("Error getting transactions")
             self.send_json_response({'error': str(e)}, 500)
     
     def handle_add_transaction(self, data):
+        # reject malformed payloads before borrowing a connection
+        params = parse_transaction(data)
+        if params is None:
+            self.send_json_response({'error': 'bad request: date, type, category, amount and currency are required'}, 400)
+            return
         try:
-            print(f"Adding transaction: {data}")
-            conn = sqlite3.connect('finance.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO transactions (date, type, category, amount, currency, note)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (data['date'], data['type'], data['category'], 
-                  data['amount'], data['currency'], data.get('note', '')))
+            logger.debug("Adding transaction: %s", data)
+            with get_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO transactions (date, type, category, amount, currency, note)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', params)
             
-            transaction_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+                transaction_id = cursor.lastrowid
+                conn.commit()
+            cache_invalidate('dashboard')
             
-            print(f"Transaction added with ID: {transaction_id}")
+            logger.info("Transaction added with ID: %s", transaction_id)
             self.send_json_response({'id': transaction_id, 'success': True})
         except Exception as e:
-            print(f"Error adding transaction: {e}")
+            logger.exception("Error adding transaction")
             self.send_json_response({'error': str(e)}, 500)
     
     def handle_get_rates(self):
         try:
-            conn = sqlite3.connect('finance.db')
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM exchange_rates ORDER BY created_at DESC')
-            rows = cursor.fetchall()
-            conn.close()
+            payload, generation = cache_lookup('rates')
+            if payload is not None:
+                self.send_json_bytes(payload)
+                return
+            with get_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT {RATE_COLUMNS}
+                    FROM exchange_rates ORDER BY created_at DESC
+                ''')
+                rates = [dict(row) for row in cursor.fetchall()]
             
-            rates = []
-            for row in rows:
-                rates.append({
-                    'id': row[0],
-                    'from_currency': row[1],
-                    'to_currency': row[2],
-                    'rate': row[3],
-                    'date': row[4],
-                    'source': row[5]
-                })
-            
-            print(f"Returning {len(rates)} exchange rates")
-            self.send_json_response(rates)
+            logger.debug("Returning %d exchange rates", len(rates))
+            payload = encode_json(rates)
+            cache_store('rates', generation, payload, RATES_CACHE_TTL)
+            self.send_json_bytes(payload)
         except Exception as e:
-            print(f"Error getting rates: {e}")
+            logger.exception("Error getting rates")
             self.send_json_response({'error': str(e)}, 500)
     
     def handle_update_rates(self):
         try:
-            print("Updating exchange rates...")
+            logger.debug("Updating exchange rates...")
             # Mock exchange rate data (replace with real API call if needed)
             rates_data = [
                 {'from': 'USD', 'to': 'CNY', 'rate': 7.2345},
@@ -191,140 +362,145 @@ class FinanceHandler(BaseHTTPRequestHandler):
                 {'from': 'CNY', 'to': 'GBP', 'rate': 0.1096}
             ]
             
-            conn = sqlite3.connect('finance.db')
-            cursor = conn.cursor()
-            
-            # Clear old rates
-            cursor.execute('DELETE FROM exchange_rates')
+            with get_conn() as conn:
+                cursor = conn.cursor()
+                today = date.today().isoformat()
+                rows = [(r['from'], r['to'], r['rate'], today) for r in rates_data]
             
-            # Insert new rates
-            today = date.today().isoformat()
-            for rate_info in rates_data:
-                cursor.execute('''
+                # Replace old rates in one write transaction (single commit/fsync)
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('DELETE FROM exchange_rates')
+                cursor.executemany('''
                     INSERT INTO exchange_rates (from_currency, to_currency, rate, date, source)
                     VALUES (?, ?, ?, ?, 'api')
-                ''', (rate_info['from'], rate_info['to'], rate_info['rate'], today))
+                ''', rows)
             
-            conn.commit()
-            conn.close()
+                conn.commit()
+            cache_invalidate('rates')
             
-            print("Exchange rates updated successfully")
+            logger.info("Exchange rates updated successfully")
             self.send_json_response({'success': True})
         except Exception as e:
-            print(f"Error updating rates: {e}")
+            logger.exception("Error updating rates")
             self.send_json_response({'error': str(e)}, 500)
     
     def handle_get_dashboard(self):
         try:
-            conn = sqlite3.connect('finance.db')
-            cursor = conn.cursor()
-            
-            # Get current month data
-            current_date = datetime.now()
-            current_month = f"{current_date.year}-{current_date.month:02d}"
-            
-            cursor.execute('''
-                SELECT type, SUM(amount) as total
-                FROM transactions 
-                WHERE date LIKE ?
-                GROUP BY type
-            ''', (f"{current_month}%",))
+            payload, generation = cache_lookup('dashboard')
+            if payload is not None:
+                self.send_json_bytes(payload)
+                return
+            with get_conn() as conn:
+                cursor = conn.cursor()
             
-            monthly_summary = [{'type': row[0], 'total': row[1]} for row in cursor.fetchall()]
+                # Get current month data
+                current_date = datetime.now()
+                month_start, month_end = month_range(current_date.year, current_date.month)
             
-            # Get recent transactions
-            cursor.execute('SELECT * FROM transactions ORDER BY date DESC, created_at DESC LIMIT 10')
-            rows = cursor.fetchall()
+                cursor.execute('''
+                    SELECT type, SUM(amount) as total
+                    FROM transactions 
+                    WHERE date >= ? AND date < ?
+                    GROUP BY type
+                ''', (month_start, month_end))
             
-            recent_transactions = []
-            for row in rows:
-                recent_transactions.append({
-                    'id': row[0],
-                    'date': row[1],
-                    'type': row[2],
-                    'category': row[3],
-                    'amount': row[4],
-                    'currency': row[5],
-                    'note': row[6] or ''
-                })
+                monthly_summary = [dict(row) for row in cursor.fetchall()]
             
-            conn.close()
+                # Get recent transactions
+                cursor.execute(f'''
+                    SELECT {TRANSACTION_COLUMNS}
+                    FROM transactions ORDER BY date DESC, created_at DESC LIMIT 10
+                ''')
+                recent_transactions = [dict(row) for row in cursor.fetchall()]
             
             dashboard_data = {
                 'monthly_summary': monthly_summary,
                 'recent_transactions': recent_transactions
             }
             
-            print(f"Dashboard data: {len(monthly_summary)} summary items, {len(recent_transactions)} recent transactions")
-            self.send_json_response(dashboard_data)
+            logger.debug("Dashboard data: %d summary items, %d recent transactions",
+                         len(monthly_summary), len(recent_transactions))
+            payload = encode_json(dashboard_data)
+            cache_store('dashboard', generation, payload, DASHBOARD_CACHE_TTL)
+            self.send_json_bytes(payload)
         except Exception as e:
-            print(f"Error getting dashboard: {e}")
+            logger.exception("Error getting dashboard")
             self.send_json_response({'error': str(e)}, 500)
     
     def handle_get_monthly_report(self):
         try:
-            path_parts = self.path.split('/')
-            year = int(path_parts[4])
-            month = int(path_parts[5])
-            
-            print(f"Generating report for {year}-{month:02d}")
-            
-            conn = sqlite3.connect('finance.db')
-            cursor = conn.cursor()
-            
-            month_str = f"{year}-{month:02d}"
+            m = _MONTHLY_RE.match(route_path(self.path))
+            if not m or not 1 <= int(m.group(2)) <= 12:
+                self.send_json_response({'error': 'Expected /api/reports/monthly/<year>/<month>'}, 400)
+                return
+            year, month = int(m.group(1)), int(m.group(2))
             
-            # Get totals by type
-            cursor.execute('''
-                SELECT type, SUM(amount) as total
-                FROM transactions 
-                WHERE date LIKE ?
-                GROUP BY type
-            ''', (f"{month_str}%",))
+            logger.debug("Generating report for %d-%02d", year, month)
             
-            totals = dict(cursor.fetchall())
+            with get_conn() as conn:
+                cursor = conn.cursor()
             
-            # Get breakdown by category
-            cursor.execute('''
-                SELECT type, category, SUM(amount) as total
-                FROM transactions 
-                WHERE date LIKE ?
-                GROUP BY type, category
-            ''', (f"{month_str}%",))
+                month_start, month_end = month_range(year, month)
             
-            expense_by_category = {}
-            income_by_category = {}
+                # Breakdown by category; the totals are derived from it (one scan)
+                cursor.execute('''
+                    SELECT type, category, SUM(amount) as total
+                    FROM transactions 
+                    WHERE date >= ? AND date < ?
+                    GROUP BY type, category
+                ''', (month_start, month_end))
             
-            for row in cursor.fetchall():
-                if row[0] == 'expense':
-                    expense_by_category[row[1]] = row[2]
-                else:
-                    income_by_category[row[1]] = row[2]
+                income_total = 0
+                expense_by_category = {}
+                income_by_category = {}
             
-            conn.close()
+                for row in cursor.fetchall():
+                    if row[0] == 'expense':
+                        expense_by_category[row[1]] = row[2]
+                    else:
+                        income_by_category[row[1]] = row[2]
+                        if row[0] == 'income':
+                            income_total += row[2]
             
+            expense_total = sum(expense_by_category.values())
             report_data = {
-                'income_total': totals.get('income', 0),
-                'expense_total': totals.get('expense', 0),
-                'net': totals.get('income', 0) - totals.get('expense', 0),
+                'income_total': income_total,
+                'expense_total': expense_total,
+                'net': income_total - expense_total,
                 'expense_by_category': expense_by_category,
                 'income_by_category': income_by_category
             }
             
-            print(f"Report generated: Income={report_data['income_total']}, Expense={report_data['expense_total']}")
+            logger.debug("Report generated: Income=%s, Expense=%s", income_total, expense_total)
             self.send_json_response(report_data)
         except Exception as e:
-            print(f"Error generating report: {e}")
+            logger.exception("Error generating report")
             self.send_json_response({'error': str(e)}, 500)
+    
+    # Exact-match routes; monthly reports are matched by prefix in do_GET
+    _GET_ROUTES = {
+        '/': serve_index,
+        '/index.html': serve_index,
+        '/api/transactions': handle_get_transactions,
+        '/api/exchange-rates': handle_get_rates,
+        '/api/dashboard': handle_get_dashboard,
+    }
+    _POST_ROUTES = {
+        '/api/transactions': lambda handler, data: handler.handle_add_transaction(data),
+        '/api/exchange-rates/update': lambda handler, data: handler.handle_update_rates(),
+    }
 
 if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    
     # Initialize database
     print("Initializing database...")
     init_database()
     
     # Start server
     server_address = ('127.0.0.1', 8000)
-    httpd = HTTPServer(server_address, FinanceHandler)
+    # one thread per request so a slow handler doesn't block other clients
+    httpd = ThreadingHTTPServer(server_address, FinanceHandler)
     print(f"Starting server on http://127.0.0.1:8000")
     print("Press Ctrl+C to stop the server")
     